@@ -6,69 +6,85 @@
 
 import logging
 from pathlib import Path
-from typing import Any, Dict, Set
+from typing import Any, Dict, Optional, Set, Tuple
 
 import yaml
 from cosl import JujuTopology
 from cosl.coordinated_workers.coordinator import ClusterRolesConfig, Coordinator
-from cosl.coordinated_workers.interface import ClusterProvider
 from cosl.coordinated_workers.worker import CERT_FILE, CLIENT_CA_FILE, KEY_FILE
 
 logger = logging.getLogger(__name__)
 
-ROLES = {
-    "overrides-exporter",
-    "query-scheduler",
-    "flusher",
-    "query-frontend",
-    "querier",
-    "store-gateway",
-    "ingester",
-    "distributor",
-    "ruler",
-    "alertmanager",
-    "compactor",
-    # meta-roles
-    "read",
-    "write",
-    "backend",
-    "all",
-}
-"""Mimir component role names."""
+try:
+    from yaml import CSafeDumper as _YamlDumper
+except ImportError:  # pragma: nocover
+    from yaml import SafeDumper as _YamlDumper
 
-META_ROLES = {
-    "read": {"querier", "query-frontend"},
-    "write": {"distributor", "ingester"},
-    "backend": {
-        "alertmanager",
-        "compactor",
+    logger.info(
+        "libyaml C bindings are not available; falling back to the pure-Python YAML dumper"
+    )
+
+ROLES = frozenset(
+    {
         "overrides-exporter",
         "query-scheduler",
-        "ruler",
+        "flusher",
+        "query-frontend",
+        "querier",
         "store-gateway",
-    },
-    "all": {
+        "ingester",
+        "distributor",
+        "ruler",
+        "alertmanager",
+        "compactor",
+        # meta-roles
+        "read",
+        "write",
+        "backend",
+        "all",
+    }
+)
+"""Mimir component role names."""
+
+META_ROLES = {
+    "read": frozenset({"querier", "query-frontend"}),
+    "write": frozenset({"distributor", "ingester"}),
+    "backend": frozenset(
+        {
+            "alertmanager",
+            "compactor",
+            "overrides-exporter",
+            "query-scheduler",
+            "ruler",
+            "store-gateway",
+        }
+    ),
+    "all": frozenset(
+        {
+            "compactor",
+            "distributor",
+            "ingester",
+            "querier",
+            "query-frontend",
+            "ruler",
+            "store-gateway",
+        }
+    ),
+}
+
+MINIMAL_DEPLOYMENT = frozenset(
+    {
+        # from official docs:
         "compactor",
         "distributor",
         "ingester",
         "querier",
         "query-frontend",
-        "ruler",
         "store-gateway",
-    },
-}
-
-MINIMAL_DEPLOYMENT = {
-    # from official docs:
-    "compactor",
-    "distributor",
-    "ingester",
-    "querier",
-    "query-frontend",
-    "store-gateway",
-    # we add:
-    "ruler",
-}
+        # we add:
+        "ruler",
+    }
+)
 """The minimal set of roles that need to be allocated for the
 deployment to be considered consistent (otherwise we set blocked). On top of what mimir itself lists as required,
 we add alertmanager."""
@@ -93,6 +109,20 @@ MIMIR_ROLES_CONFIG = ClusterRolesConfig(
 )
 """Define the configuration for Mimir roles."""
 
+# Server-side TLS config shared by the http and grpc listeners. The cert paths
+# are fixed by the worker, so the whole structure is a module constant; it is
+# only ever read (by yaml.dump), never mutated.
+_TLS_CONFIG_INNER = {
+    "cert_file": CERT_FILE,
+    "key_file": KEY_FILE,
+    "client_ca_file": CLIENT_CA_FILE,
+    "client_auth_type": "RequestClientCert",
+}
+_TLS_CONFIG = {
+    "http_tls_config": _TLS_CONFIG_INNER,
+    "grpc_tls_config": _TLS_CONFIG_INNER,
+}
+
 # The minimum number of workers per role to enable replication
 REPLICATION_MIN_WORKERS = 3
 # The default amount of replicas to set when there are enough workers per role;
@@ -100,62 +130,129 @@ REPLICATION_MIN_WORKERS = 3
 DEFAULT_REPLICATION = 3
 
 
+def _replication_factor(scale: int) -> int:
+    """Return the replication factor for a role with the given number of workers."""
+    return 1 if scale < REPLICATION_MIN_WORKERS else DEFAULT_REPLICATION
+
+
 class MimirConfig:
     """Config builder for the Mimir Coordinator."""
 
     def __init__(
         self,
-        alertmanager_urls: Set[str] = set(),
+        alertmanager_urls: Optional[Set[str]] = None,
         root_data_dir: Path = Path("/data"),
         recovery_data_dir: Path = Path("/recovery-data"),
     ):
-        self._alertmanager_urls = alertmanager_urls
+        self._alertmanager_urls = frozenset(alertmanager_urls or ())
+        self._alertmanager_url_str = ",".join(sorted(self._alertmanager_urls))
         self._root_data_dir = root_data_dir
         self._recovery_data_dir = recovery_data_dir
+        # Data-dir strings used by the per-call builders, joined once instead
+        # of going through Path.__truediv__ + str() on every config build.
+        self._alertmanager_data_dir = str(root_data_dir / "data-alertmanager")
+        self._ruler_rule_path = str(root_data_dir / "data-ruler")
+        # Rendered config cache, keyed by a fingerprint of the inputs; bounded to
+        # the last couple of entries so repeated hook invocations with unchanged
+        # cluster state skip the dict rebuild and yaml.dump altogether.
+        self._config_cache: Dict[Tuple[Any, ...], str] = {}
+        # Fragments that depend only on the data dirs never change after
+        # construction, so build them once; config() selects between these
+        # filesystem variants and the s3 ones below, mutating neither.
+        self._alertmanager_storage_cfg = self._build_alertmanager_storage_config()
+        self._compactor_cfg = self._build_compactor_config()
+        self._ruler_storage_cfg = self._build_ruler_storage_config()
+        self._blocks_storage_cfg = self._build_blocks_storage_config()
+        self._ruler_cfg = self._build_ruler_config()
+        self._tls_cfg = self._build_tls_config()
+        # S3-backed variants of the storage fragments: the filesystem backend
+        # is replaced by a bucket prefix under the common s3 storage config.
+        self._alertmanager_storage_s3_cfg = {"storage_prefix": "alerts"}
+        self._ruler_storage_s3_cfg = {"storage_prefix": "rules"}
+        self._blocks_storage_s3_cfg = {
+            key: value for key, value in self._blocks_storage_cfg.items() if key != "filesystem"
+        }
+        self._blocks_storage_s3_cfg["storage_prefix"] = "blocks"
+        # Model name, uuid and app name are fixed for the process lifetime, so
+        # the memberlist cluster label is computed once on first use.
+        self._cluster_label: Optional[str] = None
+
+    def _config_fingerprint(
+        self,
+        coordinator: Coordinator,
+        addresses: Tuple[str, ...],
+        addresses_by_role: Dict[str, Set[str]],
+    ) -> Tuple[Any, ...]:
+        """Return a hashable view of everything that can alter the rendered config."""
+        s3_view: Tuple[Any, ...] = ()
+        if coordinator.s3_ready:
+            s3_view = tuple(sorted((k, str(v)) for k, v in coordinator._s3_config.items()))
+        return (
+            tuple(sorted(self._alertmanager_urls)),
+            bool(coordinator.s3_ready),
+            s3_view,
+            bool(coordinator.nginx.are_certificates_on_disk),
+            tuple(sorted(addresses)),
+            frozenset((role, len(addrs)) for role, addrs in addresses_by_role.items()),
+            tuple(sorted(coordinator.topology.as_dict().items())),
+        )
 
     def config(self, coordinator: Coordinator) -> str:
         """Generate shared config file for mimir.
 
         Reference: https://grafana.com/docs/mimir/latest/configure/
         """
+        addresses = tuple(coordinator.cluster.gather_addresses())
+        addresses_by_role = coordinator.cluster.gather_addresses_by_role()
+
+        fingerprint = self._config_fingerprint(coordinator, addresses, addresses_by_role)
+        if cached := self._config_cache.get(fingerprint):
+            return cached
+
+        s3_ready = coordinator.s3_ready
         mimir_config: Dict[str, Any] = {
             "common": {},
-            "alertmanager": self._build_alertmanager_config(coordinator.cluster),
-            "alertmanager_storage": self._build_alertmanager_storage_config(),
-            "compactor": self._build_compactor_config(),
-            "ingester": self._build_ingester_config(coordinator.cluster),
-            "ruler": self._build_ruler_config(),
-            "ruler_storage": self._build_ruler_storage_config(),
-            "store_gateway": self._build_store_gateway_config(coordinator.cluster),
-            "blocks_storage": self._build_blocks_storage_config(),
-            "memberlist": self._build_memberlist_config(coordinator.topology, coordinator.cluster),
+            "compactor": self._compactor_cfg,
+            "blocks_storage": (
+                self._blocks_storage_s3_cfg if s3_ready else self._blocks_storage_cfg
+            ),
+            "memberlist": self._build_memberlist_config(coordinator.topology, addresses),
         }
 
-        if coordinator.s3_ready:
+        # Only emit per-role sections for roles that actually have workers;
+        # Mimir ignores config for components that are not deployed.
+        if addresses_by_role.get("alertmanager"):
+            mimir_config["alertmanager"] = self._build_alertmanager_config(addresses_by_role)
+            mimir_config["alertmanager_storage"] = (
+                self._alertmanager_storage_s3_cfg if s3_ready else self._alertmanager_storage_cfg
+            )
+        if addresses_by_role.get("ingester"):
+            mimir_config["ingester"] = self._build_ingester_config(addresses_by_role)
+        if addresses_by_role.get("ruler"):
+            mimir_config["ruler"] = self._ruler_cfg
+            mimir_config["ruler_storage"] = (
+                self._ruler_storage_s3_cfg if s3_ready else self._ruler_storage_cfg
+            )
+        if addresses_by_role.get("store-gateway"):
+            mimir_config["store_gateway"] = self._build_store_gateway_config(addresses_by_role)
+
+        if s3_ready:
             mimir_config["common"]["storage"] = self._build_s3_storage_config(
                 coordinator._s3_config
             )
-            self._update_s3_storage_config(mimir_config["blocks_storage"], "blocks")
-            self._update_s3_storage_config(mimir_config["ruler_storage"], "rules")
-            self._update_s3_storage_config(mimir_config["alertmanager_storage"], "alerts")
 
         # todo: TLS config for memberlist
         if coordinator.nginx.are_certificates_on_disk:
-            mimir_config["server"] = self._build_tls_config()
+            mimir_config["server"] = self._tls_cfg
 
-        return yaml.dump(mimir_config)
+        rendered = yaml.dump(mimir_config, Dumper=_YamlDumper, default_flow_style=False)
+        self._config_cache[fingerprint] = rendered
+        while len(self._config_cache) > 2:
+            self._config_cache.pop(next(iter(self._config_cache)))
+        return rendered
 
     def _build_tls_config(self) -> Dict[str, Any]:
-        tls_config = {
-            "cert_file": CERT_FILE,
-            "key_file": KEY_FILE,
-            "client_ca_file": CLIENT_CA_FILE,
-            "client_auth_type": "RequestClientCert",
-        }
-        return {
-            "http_tls_config": tls_config,
-            "grpc_tls_config": tls_config,
-        }
+        return _TLS_CONFIG
 
     # data_dir:
     # The Mimir Alertmanager stores the alerts state on local disk at the location configured using -alertmanager.storage.path.
@@ -163,15 +260,11 @@ class MimirConfig:
 
     # sharding_ring.replication_factor: int
     # (advanced) The replication factor to use when sharding the alertmanager.
-    def _build_alertmanager_config(self, cluster: ClusterProvider) -> Dict[str, Any]:
-        alertmanager_scale = len(cluster.gather_addresses_by_role().get("alertmanager", []))
+    def _build_alertmanager_config(self, addresses_by_role: Dict[str, Set[str]]) -> Dict[str, Any]:
+        alertmanager_scale = len(addresses_by_role.get("alertmanager", ()))
         return {
-            "data_dir": str(self._root_data_dir / "data-alertmanager"),
-            "sharding_ring": {
-                "replication_factor": (
-                    1 if alertmanager_scale < REPLICATION_MIN_WORKERS else DEFAULT_REPLICATION
-                )
-            },
+            "data_dir": self._alertmanager_data_dir,
+            "sharding_ring": {"replication_factor": _replication_factor(alertmanager_scale)},
         }
 
     # filesystem: dir
@@ -195,38 +288,28 @@ class MimirConfig:
     # Number of ingesters that each time series is replicated to. This option
     # needs be set on ingesters, distributors, queriers and rulers when running in
     # microservices mode.
-    def _build_ingester_config(self, cluster: ClusterProvider) -> Dict[str, Any]:
-        ingester_scale = len(cluster.gather_addresses_by_role().get("ingester", []))
-        return {
-            "ring": {
-                "replication_factor": (
-                    1 if ingester_scale < REPLICATION_MIN_WORKERS else DEFAULT_REPLICATION
-                )
-            }
-        }
+    def _build_ingester_config(self, addresses_by_role: Dict[str, Set[str]]) -> Dict[str, Any]:
+        ingester_scale = len(addresses_by_role.get("ingester", ()))
+        return {"ring": {"replication_factor": _replication_factor(ingester_scale)}}
 
     # rule_path:
     # Directory to store temporary rule files loaded by the Prometheus rule managers.
     # This directory is not required to be persisted between restarts.
     def _build_ruler_config(self) -> Dict[str, Any]:
         return {
-            "rule_path": str(self._root_data_dir / "data-ruler"),
-            "alertmanager_url": ",".join(sorted(self._alertmanager_urls)),
+            "rule_path": self._ruler_rule_path,
+            "alertmanager_url": self._alertmanager_url_str,
         }
 
     # sharding_ring.replication_factor:
     # (advanced) The replication factor to use when sharding blocks. This option
     # needs be set both on the store-gateway, querier and ruler when running in
     # microservices mode.
-    def _build_store_gateway_config(self, cluster: ClusterProvider) -> Dict[str, Any]:
-        store_gateway_scale = len(cluster.gather_addresses_by_role().get("store-gateway", []))
-        return {
-            "sharding_ring": {
-                "replication_factor": (
-                    1 if store_gateway_scale < REPLICATION_MIN_WORKERS else DEFAULT_REPLICATION
-                )
-            }
-        }
+    def _build_store_gateway_config(
+        self, addresses_by_role: Dict[str, Set[str]]
+    ) -> Dict[str, Any]:
+        store_gateway_scale = len(addresses_by_role.get("store-gateway", ()))
+        return {"sharding_ring": {"replication_factor": _replication_factor(store_gateway_scale)}}
 
     # filesystem: dir
     # Storage backend reads Prometheus recording rules from the local filesystem.
@@ -277,25 +360,17 @@ class MimirConfig:
 
         return s3_storage_config
 
-    def _update_s3_storage_config(self, storage_config: Dict[str, Any], prefix_name: str) -> None:
-        """Update S3 storage configuration in `storage_config`.
-
-        If the key 'filesystem' is present in `storage_config`, remove it and add a new key
-        'storage_prefix' with the value of `prefix_name` for the S3 bucket.
-        """
-        if "filesystem" in storage_config:
-            storage_config.pop("filesystem")
-            storage_config["storage_prefix"] = prefix_name
-
     # cluster_label:
     # (advanced) The cluster label is an optional string to include in outbound
     # packets and gossip streams. Other members in the memberlist cluster will
     # discard any message whose label doesn't match the configured one, unless the
     def _build_memberlist_config(
-        self, topology: JujuTopology, cluster: ClusterProvider
+        self, topology: JujuTopology, addresses: Tuple[str, ...]
     ) -> Dict[str, Any]:
-        top = topology.as_dict()
+        if self._cluster_label is None:
+            top = topology.as_dict()
+            self._cluster_label = f"{top['model']}_{top['model_uuid']}_{top['application']}"
         return {
-            "cluster_label": f"{top['model']}_{top['model_uuid']}_{top['application']}",
-            "join_members": list(cluster.gather_addresses()),
+            "cluster_label": self._cluster_label,
+            "join_members": list(addresses),
         }
@@ -2,9 +2,13 @@
 # See LICENSE file for licensing details.
 """Nginx workload."""
 
+import functools
+import itertools
 import logging
+import re
+import sys
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
 
 import crossplane
 from cosl.coordinated_workers.coordinator import Coordinator
@@ -14,6 +18,7 @@ logger = logging.getLogger(__name__)
 
 
 def _locations_distributor(tls: bool) -> List[Dict[str, Any]]:
+    scheme = "https" if tls else "http"
     return [
         {
             "directive": "location",
@@ -21,7 +26,7 @@ def _locations_distributor(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://distributor"],
+                    "args": [f"{scheme}://distributor"],
                 },
             ],
         },
@@ -31,7 +36,7 @@ def _locations_distributor(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://distributor"],
+                    "args": [f"{scheme}://distributor"],
                 },
             ],
         },
@@ -41,7 +46,7 @@ def _locations_distributor(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://distributor"],
+                    "args": [f"{scheme}://distributor"],
                 },
             ],
         },
@@ -49,6 +54,7 @@ def _locations_distributor(tls: bool) -> List[Dict[str, Any]]:
 
 
 def _locations_alertmanager(tls: bool) -> List[Dict[str, Any]]:
+    scheme = "https" if tls else "http"
     return [
         {
             "directive": "location",
@@ -56,7 +62,7 @@ def _locations_alertmanager(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://alertmanager"],
+                    "args": [f"{scheme}://alertmanager"],
                 },
             ],
         },
@@ -66,7 +72,7 @@ def _locations_alertmanager(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://alertmanager"],
+                    "args": [f"{scheme}://alertmanager"],
                 },
             ],
         },
@@ -76,7 +82,7 @@ def _locations_alertmanager(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://alertmanager"],
+                    "args": [f"{scheme}://alertmanager"],
                 },
             ],
         },
@@ -84,6 +90,7 @@ def _locations_alertmanager(tls: bool) -> List[Dict[str, Any]]:
 
 
 def _locations_ruler(tls: bool) -> List[Dict[str, Any]]:
+    scheme = "https" if tls else "http"
     return [
         {
             "directive": "location",
@@ -91,7 +98,7 @@ def _locations_ruler(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://ruler"],
+                    "args": [f"{scheme}://ruler"],
                 },
             ],
         },
@@ -101,7 +108,7 @@ def _locations_ruler(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://ruler"],
+                    "args": [f"{scheme}://ruler"],
                 },
             ],
         },
@@ -111,7 +118,7 @@ def _locations_ruler(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://ruler"],
+                    "args": [f"{scheme}://ruler"],
                 },
             ],
         },
@@ -121,7 +128,7 @@ def _locations_ruler(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://ruler"],
+                    "args": [f"{scheme}://ruler"],
                 },
             ],
         },
@@ -129,6 +136,7 @@ def _locations_ruler(tls: bool) -> List[Dict[str, Any]]:
 
 
 def _locations_query_frontend(tls: bool) -> List[Dict[str, Any]]:
+    scheme = "https" if tls else "http"
     return [
         {
             "directive": "location",
@@ -136,7 +144,7 @@ def _locations_query_frontend(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://query-frontend"],
+                    "args": [f"{scheme}://query-frontend"],
                 },
             ],
         },
@@ -147,7 +155,7 @@ def _locations_query_frontend(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://query-frontend"],
+                    "args": [f"{scheme}://query-frontend"],
                 },
             ],
         },
@@ -155,6 +163,7 @@ def _locations_query_frontend(tls: bool) -> List[Dict[str, Any]]:
 
 
 def _locations_compactor(tls: bool) -> List[Dict[str, Any]]:
+    scheme = "https" if tls else "http"
     return [
         # Compactor endpoint for uploading blocks
         {
@@ -163,14 +172,36 @@ def _locations_compactor(tls: bool) -> List[Dict[str, Any]]:
             "block": [
                 {
                     "directive": "proxy_pass",
-                    "args": [f"{'https' if tls else 'http'}://compactor"],
+                    "args": [f"{scheme}://compactor"],
                 },
             ],
         },
     ]
 
 
-LOCATIONS_BASIC: List[Dict[str, Any]] = [
+def _log_verbose(verbose: bool = True) -> List[Dict[str, Any]]:
+    if verbose:
+        return [{"directive": "access_log", "args": ["/dev/stderr", "main"]}]
+    return [
+        {
+            "directive": "map",
+            "args": ["$status", "$loggable"],
+            "block": [
+                {"directive": "~^[23]", "args": ["0"]},
+                {"directive": "default", "args": ["1"]},
+            ],
+        },
+        {"directive": "access_log", "args": ["/dev/stderr"]},
+    ]
+
+
+def _resolver(custom_resolver: Optional[str] = None) -> List[Dict[str, Any]]:
+    if custom_resolver:
+        return [{"directive": "resolver", "args": [custom_resolver]}]
+    return [{"directive": "resolver", "args": ["kube-dns.kube-system.svc.cluster.local."]}]
+
+
+LOCATIONS_BASIC: Tuple[Dict[str, Any], ...] = (
     {
         "directive": "location",
         "args": ["=", "/"],
@@ -186,97 +217,134 @@ LOCATIONS_BASIC: List[Dict[str, Any]] = [
             {"directive": "stub_status", "args": []},
         ],
     },
-]
+)
+
+
+# Per-role location fragments, pre-built at import time for both schemes so
+# per-render calls only concatenate shared, read-only tuples. Index with
+# int(tls): [0] is plain http, [1] is https.
+_LOCATIONS_BY_ROLE: Dict[str, Tuple[Tuple[Dict[str, Any], ...], Tuple[Dict[str, Any], ...]]] = {
+    "distributor": (tuple(_locations_distributor(False)), tuple(_locations_distributor(True))),
+    "alertmanager": (tuple(_locations_alertmanager(False)), tuple(_locations_alertmanager(True))),
+    "ruler": (tuple(_locations_ruler(False)), tuple(_locations_ruler(True))),
+    "query-frontend": (
+        tuple(_locations_query_frontend(False)),
+        tuple(_locations_query_frontend(True)),
+    ),
+    "compactor": (tuple(_locations_compactor(False)), tuple(_locations_compactor(True))),
+}
+
+# Everything in the rendered config apart from the upstreams and the server
+# block is constant, so the skeleton is built once at import time. crossplane
+# only reads the tree, so the shared dicts are safe across renders.
+_STATIC_TOP_LEVEL: Tuple[Dict[str, Any], ...] = (
+    {"directive": "worker_processes", "args": ["5"]},
+    {"directive": "error_log", "args": ["/dev/stderr", "error"]},
+    {"directive": "pid", "args": ["/tmp/nginx.pid"]},
+    {"directive": "worker_rlimit_nofile", "args": ["8192"]},
+    {
+        "directive": "events",
+        "args": [],
+        "block": [{"directive": "worker_connections", "args": ["4096"]}],
+    },
+)
+
+_HTTP_BLOCK_STATIC: Tuple[Dict[str, Any], ...] = (
+    # temp paths
+    {"directive": "client_body_temp_path", "args": ["/tmp/client_temp"]},
+    {"directive": "proxy_temp_path", "args": ["/tmp/proxy_temp_path"]},
+    {"directive": "fastcgi_temp_path", "args": ["/tmp/fastcgi_temp"]},
+    {"directive": "uwsgi_temp_path", "args": ["/tmp/uwsgi_temp"]},
+    {"directive": "scgi_temp_path", "args": ["/tmp/scgi_temp"]},
+    # logging
+    {"directive": "default_type", "args": ["application/octet-stream"]},
+    {
+        "directive": "log_format",
+        "args": [
+            "main",
+            '$remote_addr - $remote_user [$time_local]  $status "$request" $body_bytes_sent "$http_referer" "$http_user_agent" "$http_x_forwarded_for"',
+        ],
+    },
+    *_log_verbose(verbose=False),
+    # mimir-related
+    {"directive": "sendfile", "args": ["on"]},
+    {"directive": "tcp_nopush", "args": ["on"]},
+    *_resolver(custom_resolver=None),
+    # TODO: add custom http block for the user to config?
+    {
+        "directive": "map",
+        "args": ["$http_x_scope_orgid", "$ensured_x_scope_orgid"],
+        "block": [
+            {"directive": "default", "args": ["$http_x_scope_orgid"]},
+            {"directive": "", "args": ["anonymous"]},
+        ],
+    },
+    {"directive": "proxy_read_timeout", "args": ["300"]},
+)
 
 
 class NginxConfig:
     """Helper class to manage the nginx workload."""
 
+    __slots__ = ("dns_IP_address", "_cache")
+
     def __init__(self):
         self.dns_IP_address = _get_dns_ip_address()
+        # Last rendered config, keyed on the inputs that shape it. Cluster
+        # topology rarely changes between hook invocations, so most rebuilds
+        # can return the cached string without re-running crossplane.
+        self._cache: Optional[Tuple[Any, str]] = None
 
     def config(self, coordinator: Coordinator) -> str:
         """Build and return the Nginx configuration."""
-        log_level = "error"
-        addresses_by_role = coordinator.cluster.gather_addresses_by_role()
-
-        # build the complete configuration
+        # Canonicalize the mapping once: interned strings (the same handful of
+        # values recurs in every upstream block and cache key) and sorted
+        # tuples, so identical inputs always render byte-identical configs
+        # instead of varying with set iteration order.
+        addresses_by_role = {
+            sys.intern(role): tuple(sorted(sys.intern(addr) for addr in addrs))
+            for role, addrs in coordinator.cluster.gather_addresses_by_role().items()
+        }
+        nginx_port = coordinator.nginx.options["nginx_port"]
+        tls = coordinator.nginx.are_certificates_on_disk
+        server_name = coordinator.hostname
+
+        cache_key = (
+            server_name,
+            nginx_port,
+            bool(tls),
+            tuple(sorted(addresses_by_role.items())),
+        )
+        if self._cache and self._cache[0] == cache_key:
+            return self._cache[1]
+
+        # build the complete configuration around the static skeleton
         full_config = [
-            {"directive": "worker_processes", "args": ["5"]},
-            {"directive": "error_log", "args": ["/dev/stderr", log_level]},
-            {"directive": "pid", "args": ["/tmp/nginx.pid"]},
-            {"directive": "worker_rlimit_nofile", "args": ["8192"]},
-            {
-                "directive": "events",
-                "args": [],
-                "block": [{"directive": "worker_connections", "args": ["4096"]}],
-            },
+            *_STATIC_TOP_LEVEL,
             {
                 "directive": "http",
                 "args": [],
                 "block": [
                     # upstreams (load balancing)
-                    *self._upstreams(addresses_by_role, coordinator.nginx.options["nginx_port"]),
-                    # temp paths
-                    {"directive": "client_body_temp_path", "args": ["/tmp/client_temp"]},
-                    {"directive": "proxy_temp_path", "args": ["/tmp/proxy_temp_path"]},
-                    {"directive": "fastcgi_temp_path", "args": ["/tmp/fastcgi_temp"]},
-                    {"directive": "uwsgi_temp_path", "args": ["/tmp/uwsgi_temp"]},
-                    {"directive": "scgi_temp_path", "args": ["/tmp/scgi_temp"]},
-                    # logging
-                    {"directive": "default_type", "args": ["application/octet-stream"]},
-                    {
-                        "directive": "log_format",
-                        "args": [
-                            "main",
-                            '$remote_addr - $remote_user [$time_local]  $status "$request" $body_bytes_sent "$http_referer" "$http_user_agent" "$http_x_forwarded_for"',
-                        ],
-                    },
-                    *self._log_verbose(verbose=False),
-                    # mimir-related
-                    {"directive": "sendfile", "args": ["on"]},
-                    {"directive": "tcp_nopush", "args": ["on"]},
-                    *self._resolver(custom_resolver=None),
-                    # TODO: add custom http block for the user to config?
-                    {
-                        "directive": "map",
-                        "args": ["$http_x_scope_orgid", "$ensured_x_scope_orgid"],
-                        "block": [
-                            {"directive": "default", "args": ["$http_x_scope_orgid"]},
-                            {"directive": "", "args": ["anonymous"]},
-                        ],
-                    },
-                    {"directive": "proxy_read_timeout", "args": ["300"]},
+                    *self._upstreams(addresses_by_role, nginx_port),
+                    *_HTTP_BLOCK_STATIC,
                     # server block
                     self._server(
-                        server_name=coordinator.hostname,
+                        server_name=server_name,
                         addresses_by_role=addresses_by_role,
-                        nginx_port=coordinator.nginx.options["nginx_port"],
-                        tls=coordinator.nginx.are_certificates_on_disk,
+                        nginx_port=nginx_port,
+                        tls=tls,
                     ),
                 ],
             },
         ]
 
-        return crossplane.build(full_config)
-
-    def _log_verbose(self, verbose: bool = True) -> List[Dict[str, Any]]:
-        if verbose:
-            return [{"directive": "access_log", "args": ["/dev/stderr", "main"]}]
-        return [
-            {
-                "directive": "map",
-                "args": ["$status", "$loggable"],
-                "block": [
-                    {"directive": "~^[23]", "args": ["0"]},
-                    {"directive": "default", "args": ["1"]},
-                ],
-            },
-            {"directive": "access_log", "args": ["/dev/stderr"]},
-        ]
+        rendered = crossplane.build(full_config)
+        self._cache = (cache_key, rendered)
+        return rendered
 
     def _upstreams(
-        self, addresses_by_role: Dict[str, Set[str]], nginx_port: int
+        self, addresses_by_role: Mapping[str, Sequence[str]], nginx_port: int
     ) -> List[Dict[str, Any]]:
         nginx_upstreams = []
         for role, address_set in addresses_by_role.items():
@@ -294,27 +362,19 @@ class NginxConfig:
         return nginx_upstreams
 
     def _locations(
-        self, addresses_by_role: Dict[str, Set[str]], tls: bool
+        self, addresses_by_role: Mapping[str, Sequence[str]], tls: bool
     ) -> List[Dict[str, Any]]:
-        nginx_locations = LOCATIONS_BASIC.copy()
-        roles = addresses_by_role.keys()
-
-        if "distributor" in roles:
-            nginx_locations.extend(_locations_distributor(tls))
-        if "alertmanager" in roles:
-            nginx_locations.extend(_locations_alertmanager(tls))
-        if "ruler" in roles:
-            nginx_locations.extend(_locations_ruler(tls))
-        if "query-frontend" in roles:
-            nginx_locations.extend(_locations_query_frontend(tls))
-        if "compactor" in roles:
-            nginx_locations.extend(_locations_compactor(tls))
-        return nginx_locations
-
-    def _resolver(self, custom_resolver: Optional[str] = None) -> List[Dict[str, Any]]:
-        if custom_resolver:
-            return [{"directive": "resolver", "args": [custom_resolver]}]
-        return [{"directive": "resolver", "args": ["kube-dns.kube-system.svc.cluster.local."]}]
+        scheme_idx = int(tls)
+        return list(
+            itertools.chain(
+                LOCATIONS_BASIC,
+                *(
+                    fragments[scheme_idx]
+                    for role, fragments in _LOCATIONS_BY_ROLE.items()
+                    if role in addresses_by_role
+                ),
+            )
+        )
 
     def _basic_auth(self, enabled: bool) -> List[Optional[Dict[str, Any]]]:
         if enabled:
@@ -330,7 +390,7 @@ class NginxConfig:
     def _server(
         self,
         server_name: str,
-        addresses_by_role: Dict[str, Set[str]],
+        addresses_by_role: Mapping[str, Sequence[str]],
         nginx_port: int,
         tls: bool = False,
     ) -> Dict[str, Any]:
@@ -356,7 +416,7 @@ class NginxConfig:
                     {"directive": "ssl_ciphers", "args": ["HIGH:!aNULL:!MD5"]},  # pyright: ignore
                     # specify resolver to ensure that if a unit IP changes,
                     # we reroute to the new one
-                    *self._resolver(custom_resolver=self.dns_IP_address),
+                    *_resolver(custom_resolver=self.dns_IP_address),
                     *self._locations(addresses_by_role, tls),
                 ],
             }
@@ -372,17 +432,24 @@ class NginxConfig:
                     "directive": "proxy_set_header",
                     "args": ["X-Scope-OrgID", "$ensured_x_scope_orgid"],
                 },
-                *self._resolver(custom_resolver=self.dns_IP_address),
+                *_resolver(custom_resolver=self.dns_IP_address),
                 *self._locations(addresses_by_role, tls),
             ],
         }
 
 
+# assume there's only one nameserver; take the first match
+_NAMESERVER_RE = re.compile(rb"^nameserver[ \t]+(\S+)", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=1)
 def _get_dns_ip_address():
-    """Obtain DNS ip address from /etc/resolv.conf."""
-    resolv = Path("/etc/resolv.conf").read_text()
-    for line in resolv.splitlines():
-        if line.startswith("nameserver"):
-            # assume there's only one
-            return line.split()[1].strip()
-    raise RuntimeError("cannot find nameserver in /etc/resolv.conf")
+    """Obtain DNS ip address from /etc/resolv.conf.
+
+    The nameserver cannot change for the lifetime of the pod, so the file is
+    read and parsed only once per process.
+    """
+    match = _NAMESERVER_RE.search(Path("/etc/resolv.conf").read_bytes())
+    if not match:
+        raise RuntimeError("cannot find nameserver in /etc/resolv.conf")
+    return match.group(1).decode()
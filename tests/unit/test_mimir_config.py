@@ -2,6 +2,7 @@ import unittest
 from unittest.mock import MagicMock
 
 import pytest
+import yaml
 from deepdiff import DeepDiff
 
 from src.mimir_config import MimirConfig
@@ -55,6 +56,59 @@ def topology():
     return top
 
 
+@pytest.fixture
+def partial_coordinator():
+    """A coordinator without s3, TLS, or workers for the ruler and store-gateway roles."""
+    coord = MagicMock()
+    coord.topology = MagicMock()
+    coord.topology.as_dict = MagicMock(
+        return_value={
+            "model": "some-model",
+            "model_uuid": "some-uuid",
+            "application": "mimir",
+            "unit": "mimir-0",
+            "charm_name": "mimir-coordinator-k8s",
+        }
+    )
+    coord.cluster = MagicMock()
+    coord.cluster.gather_addresses_by_role = MagicMock(
+        return_value={
+            "alertmanager": ["http://some.mimir.worker.0:8080"],
+            "ingester": ["http://some.mimir.worker.0:8080"],
+        }
+    )
+    coord.cluster.gather_addresses = MagicMock(return_value=["http://some.mimir.worker.0:8080"])
+    coord.s3_ready = False
+    coord.nginx = MagicMock()
+    coord.nginx.are_certificates_on_disk = False
+    return coord
+
+
+def test_config_sections_follow_deployed_roles(mimir_config, partial_coordinator):
+    config = yaml.safe_load(mimir_config.config(partial_coordinator))
+    assert "alertmanager" in config
+    assert config["alertmanager_storage"] == {
+        "filesystem": {"dir": "/recovery-data/data-alertmanager"}
+    }
+    assert "ingester" in config
+    for role_section in ("ruler", "ruler_storage", "store_gateway", "server"):
+        assert role_section not in config
+    assert config["blocks_storage"]["filesystem"] == {"dir": "/data/blocks"}
+
+
+def test_config_is_cached_until_cluster_changes(mimir_config, partial_coordinator):
+    first = mimir_config.config(partial_coordinator)
+    assert mimir_config.config(partial_coordinator) is first
+
+    addresses_by_role = partial_coordinator.cluster.gather_addresses_by_role()
+    partial_coordinator.cluster.gather_addresses_by_role = MagicMock(
+        return_value={**addresses_by_role, "ruler": ["http://some.mimir.worker.1:8080"]}
+    )
+    second = mimir_config.config(partial_coordinator)
+    assert second is not first
+    assert "ruler" in yaml.safe_load(second)
+
+
 @pytest.mark.parametrize(
     "addresses_by_role, replication",
     [
@@ -64,8 +118,7 @@ def topology():
     ],
 )
 def test_build_alertmanager_config(mimir_config, coordinator, addresses_by_role, replication):
-    coordinator.cluster.gather_addresses_by_role.return_value = addresses_by_role
-    alertmanager_config = mimir_config._build_alertmanager_config(coordinator.cluster)
+    alertmanager_config = mimir_config._build_alertmanager_config(addresses_by_role)
     expected_config = {
         "data_dir": "/data/data-alertmanager",
         "sharding_ring": {"replication_factor": replication},
@@ -94,8 +147,7 @@ def test_build_compactor_config(mimir_config):
     ],
 )
 def test_build_ingester_config(mimir_config, coordinator, addresses_by_role, replication):
-    coordinator.cluster.gather_addresses_by_role.return_value = addresses_by_role
-    ingester_config = mimir_config._build_ingester_config(coordinator.cluster)
+    ingester_config = mimir_config._build_ingester_config(addresses_by_role)
     expected_config = {"ring": {"replication_factor": replication}}
     assert ingester_config == expected_config
 
@@ -118,8 +170,7 @@ def test_build_ruler_config(mimir_config):
     ],
 )
 def test_build_store_gateway_config(mimir_config, coordinator, addresses_by_role, replication):
-    coordinator.cluster.gather_addresses_by_role.return_value = addresses_by_role
-    store_gateway_config = mimir_config._build_store_gateway_config(coordinator.cluster)
+    store_gateway_config = mimir_config._build_store_gateway_config(addresses_by_role)
     expected_config = {"sharding_ring": {"replication_factor": replication}}
     store_gateway_config == expected_config
 
@@ -168,22 +219,19 @@ def test_build_s3_storage_config(mimir_config, coordinator):
     assert s3_storage_config_https == expected_config_https
 
 
-def test_update_s3_storage_config(mimir_config):
-    storage_config = {"filesystem": {"dir": "/data/blocks"}}
-    mimir_config._update_s3_storage_config(storage_config, "blocks")
-    expected_config = {"storage_prefix": "blocks"}
-    assert storage_config == expected_config
-
-
-def test_empty_update_s3_storage_config(mimir_config):
-    storage_config = {"storage_prefix": "blocks"}
-    mimir_config._update_s3_storage_config(storage_config, "blocks")
-    expected_config = {"storage_prefix": "blocks"}
-    assert storage_config == expected_config
+def test_s3_storage_config_fragments(mimir_config):
+    assert mimir_config._alertmanager_storage_s3_cfg == {"storage_prefix": "alerts"}
+    assert mimir_config._ruler_storage_s3_cfg == {"storage_prefix": "rules"}
+    assert mimir_config._blocks_storage_s3_cfg == {
+        "bucket_store": {"sync_dir": "/data/tsdb-sync"},
+        "tsdb": {"dir": "/data/tsdb"},
+        "storage_prefix": "blocks",
+    }
 
 
 def test_build_memberlist_config(mimir_config, topology, coordinator):
-    memberlist_config = mimir_config._build_memberlist_config(topology, coordinator.cluster)
+    addresses = tuple(coordinator.cluster.gather_addresses())
+    memberlist_config = mimir_config._build_memberlist_config(topology, addresses)
     expected_config = {
         "cluster_label": "some-model_some-uuid_mimir",
         "join_members": ["http://some.mimir.worker.0:8080", "http://some.mimir.worker.1:8080"],
@@ -53,6 +53,51 @@ def topology():
     return top
 
 
+@pytest.fixture
+def cache_coordinator():
+    """A coordinator whose config-shaping attributes can be flipped one at a time."""
+    coord = MagicMock()
+    coord.hostname = "mimir-0.example.com"
+    coord.cluster = MagicMock()
+    coord.cluster.gather_addresses_by_role = MagicMock(
+        return_value={"distributor": ["http://some.mimir.worker.0:8080"]}
+    )
+    coord.nginx = MagicMock()
+    coord.nginx.options = {"nginx_port": 8080}
+    coord.nginx.are_certificates_on_disk = False
+    return coord
+
+
+def test_config_is_cached_until_inputs_change(nginx_config, cache_coordinator):
+    first = nginx_config.config(cache_coordinator)
+    assert nginx_config.config(cache_coordinator) is first
+
+    cache_coordinator.nginx.options = {"nginx_port": 9009}
+    second = nginx_config.config(cache_coordinator)
+    assert second is not first
+    assert ":9009" in second
+
+    cache_coordinator.nginx.are_certificates_on_disk = True
+    third = nginx_config.config(cache_coordinator)
+    assert third is not second
+    assert "ssl_certificate" in third
+
+    cache_coordinator.hostname = "mimir-1.example.com"
+    fourth = nginx_config.config(cache_coordinator)
+    assert fourth is not third
+    assert "mimir-1.example.com" in fourth
+
+    cache_coordinator.cluster.gather_addresses_by_role = MagicMock(
+        return_value={
+            "distributor": ["http://some.mimir.worker.0:8080"],
+            "ruler": ["http://some.mimir.worker.1:8080"],
+        }
+    )
+    fifth = nginx_config.config(cache_coordinator)
+    assert fifth is not fourth
+    assert "upstream ruler" in fifth
+
+
 @pytest.mark.parametrize(
     "addresses_by_role",
     [